@@ -10,6 +10,7 @@ Notice:
 1. The final output might have fewer records than the original gatk vcf data because the script will filter out the records that don't have VAF info.
 2. We use the genomic mutation (chrom+pos+ref+alt) identified in pan-cancer to identify pan-cancer records.
 3. We use transcript mutations (because only one transcript) info to identify mutations that can be found in c-bio and cosmic database.
+4. The parsed pan-cancer, c-bio and cosmic reference tables are cached in package_location/cache, and they are rebuilt when the reference files change.
 
 It will create one output:
 1. Final_sample_sum_out (the df contains the annovar info that has the mutation found in pan-cancer (including synonymous mutations), c-bioprotal, cosmic, and remained)
@@ -23,7 +24,6 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from natsort import index_natsorted, natsort_keygen, natsorted, order_by_index
 
 # Create the argument parser
 parser = argparse.ArgumentParser(description="Script to extract somatic mutations")
@@ -62,38 +62,7 @@ from somatic_germline_module import *
 package_location = Path(package_location)
 translate_to = "human"
 
-pan_cancer_annovar_file = (
-    package_location
-    / "data_source"
-    / "Ge2_Pass_QC_Pan_Cancer_Final_Mutect_annovar_include_syn_mutation_summary.txt"
-)
-c_bioportal_file = (
-    package_location / "data_source" / "all_studies_c-bio_portal_somatic_mutation.txt"
-)
-cosmic_file = (
-    package_location / "data_source" / "GRCh37_V95_Cosmic_somatic_mutation.txt"
-)
-c_bio_translate_file = (
-    package_location
-    / "data_source"
-    / "c-bio_Human_GR37_103_canine_3.199_sequenceAlignment.txt"
-)
-cosmic_translate_file = (
-    package_location
-    / "data_source"
-    / "COSMIC_V95_Human_GR37_93_canine_3.199_sequenceAlignment.txt"
-)
 retro_gene_file = package_location / "data_source" / "retro_gene_list.txt"
-c_biohuman_dog_transcript = (
-    package_location
-    / "data_source"
-    / "c_bioportal_Human_GR37_103_dog_transcript_3.199.txt"
-)
-cosm_human_dog_transcript = (
-    package_location
-    / "data_source"
-    / "COSMIC_Human_GR37_V95_93_dog_transcript_3.199.txt"
-)
 ## process annovar out and extract all of the annovar information
 target_annovar_info = processAnnovar(annovar_gene_file, retro_gene_file, sample_name)
 
@@ -101,19 +70,25 @@ target_annovar_info = processAnnovar(annovar_gene_file, retro_gene_file, sample_
 target_gatk = process_gatk_output(gatk_vcf)
 
 ### merge GATK and annovar information
+## use the same Chrom categories as annovar, so the merge can use the category codes
+## annovar only has the exonic records, so drop the GATK chromosomes annovar doesn't have first
+## (the inner merge drops them anyway)
+annovar_chroms = target_annovar_info["Chrom"].cat.categories
+target_gatk = target_gatk[target_gatk["Chrom"].isin(annovar_chroms)].assign(
+    Chrom=lambda gatk_df: pd.Categorical(gatk_df["Chrom"], categories=annovar_chroms)
+)
+## target_gatk only has the records with VAF info, so inner merge keeps the annovar records that have the VAF
 merge_gatk_annovar = target_annovar_info.merge(
-    target_gatk, on=["Line", "Chrom", "Sample_name"], how="left"
+    target_gatk, on=["Line", "Chrom", "Sample_name"], how="inner", validate="m:1"
 )
-merge_gatk_annovar = merge_gatk_annovar.loc[
-    pd.notna(merge_gatk_annovar["Ref_reads"])
-    & pd.notna(merge_gatk_annovar["Alt_reads"])
-    & (~merge_gatk_annovar["Ref_reads"].astype(str).str.contains("No info provided"))
-    & (~merge_gatk_annovar["Alt_reads"].astype(str).str.contains("No info provided"))
-]
 
-merge_gatk_annovar.loc[:, "VAF"] = merge_gatk_annovar["Alt_reads"].astype(float) / (
-    merge_gatk_annovar["Ref_reads"].astype(float)
-    + merge_gatk_annovar["Alt_reads"].astype(float)
+# VAF = alt / (ref + alt), records without any reads get NaN instead of a division by zero
+# VAF is just a ratio, so float32 is precise enough
+ref_reads = merge_gatk_annovar["Ref_reads"].to_numpy(dtype=np.float32)
+alt_reads = merge_gatk_annovar["Alt_reads"].to_numpy(dtype=np.float32)
+total_reads = ref_reads + alt_reads
+merge_gatk_annovar["VAF"] = np.divide(
+    alt_reads, total_reads, out=np.full_like(alt_reads, np.nan), where=total_reads > 0
 )
 
 
@@ -139,86 +114,70 @@ target_column = [
     "VAF",
 ]
 
-target_merge_gatk_annovar = merge_gatk_annovar[target_column]
-target_merge_gatk_annovar_columns = target_merge_gatk_annovar.columns.values
-
 # change column names: Ref_y,Alt_y to Ref, Alt
-target_merge_gatk_annovar.rename(columns={"Ref_y": "Ref", "Alt_y": "Alt"}, inplace=True)
-target_merge_gatk_annovar.loc[:, "Chrom_mut_info"] = (
-    target_merge_gatk_annovar["Chrom"]
-    + "_"
-    + target_merge_gatk_annovar["Start"].astype(str)
-    + "_"
-    + target_merge_gatk_annovar["Ref"]
-    + "_"
-    + target_merge_gatk_annovar["Alt"]
+target_merge_gatk_annovar = (
+    merge_gatk_annovar[target_column]
+    .rename(columns={"Ref_y": "Ref", "Alt_y": "Alt"})
+    .assign(
+        Chrom_mut_info=lambda merge_df: build_chrom_mut_info(
+            merge_df["Chrom"], merge_df["Start"], merge_df["Ref"], merge_df["Alt"]
+        )
+    )
 )
 
 ## filtering with canine pan-cancer, change to use genomic_location to idenfiy somatic mutation rather than using gene names mutation or transcripts mutation
 ## process pan-cancer data
-pan_cancer_data = pd.read_csv(pan_cancer_annovar_file, sep="\t")
-pan_cancer_source = list(
-    set(
-        list(
-            pan_cancer_data["Chrom"]
-            + "_"
-            + pan_cancer_data["Pos"].astype(str)
-            + "_"
-            + pan_cancer_data["Ref"]
-            + "_"
-            + pan_cancer_data["Alt"]
-        )
-    )
+reference_indices = build_reference_indices(package_location)
+pan_cancer_pass = target_merge_gatk_annovar.merge(
+    reference_indices["pan_cancer"],
+    left_on="Chrom_mut_info",
+    right_index=True,
+    how="inner",
+    validate="m:1",
 )
-pan_cancer_pass = target_merge_gatk_annovar[
-    target_merge_gatk_annovar["Chrom_mut_info"].isin(pan_cancer_source)
-]
 
 ######### Process human somatic data
+## parse the protein changes once and use it for both c-bio and cosmic
+parsed_mut_info = parse_gene_mut_info(target_merge_gatk_annovar["Gene_mut_info"])
 ## process c-bio files
 c_bio_pass = extract_human_somatic(
-    c_bioportal_file,
-    c_bio_translate_file,
-    c_biohuman_dog_transcript,
+    reference_indices["c_bio"],
     target_merge_gatk_annovar,
     translate_to,
+    parsed_mut_info,
 )
 
 cosm_pass = extract_human_somatic(
-    cosmic_file,
-    cosmic_translate_file,
-    cosm_human_dog_transcript,
+    reference_indices["cosmic"],
     target_merge_gatk_annovar,
     translate_to,
+    parsed_mut_info,
 )
 
 
-cosm_pass_uniq = cosm_pass.merge(c_bio_pass, how="outer", indicator=True).loc[
-    lambda x: x["_merge"] == "left_only"
-]
-# c_bio_pass_uniq = cosm_pass.merge(c_bio_pass, how="outer", indicator=True).loc[
-#     lambda x: x["_merge"] == "right_only"
-# ]
-## The majority of Cosmic is overlapped with C-bio, so if I found the same, remove it
-cosm_pass_uniq = cosm_pass_uniq.drop(columns="_merge")
-
-if not pan_cancer_pass.empty:
-    pan_cancer_pass.loc[:, "Source"] = "Pan-cancer"
-
-if not c_bio_pass.empty:
-    c_bio_pass.loc[:, "Source"] = "C-bio"
+## The majority of Cosmic is overlapped with C-bio, so if I found the same mutation in C-bio, remove it
+## the kept rows stay in the annovar order, so if one record has several Cosmic-only annotations,
+## the first annotation row is the one left after the (Line, Chrom_mut_info) dedup
+c_bio_pass_mutations = set(c_bio_pass["Chrom_mut_info"])
+cosm_pass_uniq = cosm_pass[~cosm_pass["Chrom_mut_info"].isin(c_bio_pass_mutations)]
 
-if not cosm_pass_uniq.empty:
-    cosm_pass_uniq.loc[:, "Source"] = "Cosmic"
+pan_cancer_pass = pan_cancer_pass.assign(Source="Pan-cancer")
+c_bio_pass = c_bio_pass.assign(Source="C-bio")
+cosm_pass_uniq = cosm_pass_uniq.assign(Source="Cosmic")
 
 
-if pan_cancer_pass.empty and c_bio_pass.empty and cosm_pass_uniq.empty:
-    final_panancer_cbio_cosmic = pd.DataFrame([], columns=["Line", "Chrom_mut_info"])
-else:
-    final_panancer_cbio_cosmic = pd.DataFrame()
+## concat only the non-empty tables, all-empty tables in concat are deprecated in pandas
+passed_frames = [
+    passed_df
+    for passed_df in [pan_cancer_pass, c_bio_pass, cosm_pass_uniq]
+    if not passed_df.empty
+]
+if passed_frames:
     final_panancer_cbio_cosmic = pd.concat(
-        [pan_cancer_pass, c_bio_pass, cosm_pass_uniq], ignore_index=True
+        passed_frames, ignore_index=True
     ).drop_duplicates(subset=["Line", "Chrom_mut_info"])
+else:
+    final_panancer_cbio_cosmic = pd.DataFrame([], columns=["Line", "Chrom_mut_info"])
 
 # Keep remaining Annovar files not in pan-cancer and c-bio for future VAF examination
 passed_info = final_panancer_cbio_cosmic["Chrom_mut_info"].unique().tolist()
@@ -226,17 +185,22 @@ passed_info = final_panancer_cbio_cosmic["Chrom_mut_info"].unique().tolist()
 ## remained mutations are those not found in c-bio, cosmic, and pan-cancer
 remained_df = target_merge_gatk_annovar[
     ~target_merge_gatk_annovar["Chrom_mut_info"].isin(passed_info)
-]
-remained_df["Source"] = "Remained"
+].assign(Source="Remained")
 # Combine remaining data with passed data
+## if there is no mutation at all, the empty remained_df still keeps the output columns
+final_frames = [
+    final_df
+    for final_df in [final_panancer_cbio_cosmic, remained_df]
+    if not final_df.empty
+]
 total_final_out = pd.concat(
-    [final_panancer_cbio_cosmic, remained_df], ignore_index=True
+    final_frames or [remained_df], ignore_index=True
 ).drop_duplicates()
 
 # Remove 'VAF_info' column to reduce the file size and sort the DataFrame
 total_final_out = (
     total_final_out.drop("VAF_info", axis=1)
-    .sort_values(by="Line", key=natsort_keygen())
+    .sort_values(by="Line", kind="stable")
     .drop(columns="Line")
 )
 
@@ -9,27 +9,50 @@ The script contains the functions used in Sapelo2_extract_somatic_germline.py
 """
 
 import collections
+import functools
+import hashlib
 import os
+import pickle
 import re
 import sys
 from copy import copy
+from itertools import chain
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+## the pyarrow engine reads the large reference tables and the gatk output with multiple threads,
+## use the default C engine if pyarrow is not installed
+try:
+    import pyarrow
+    import pyarrow.csv
 
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+## regex used to extract the annovar info and the protein changes, compiled once here
+_RE_ENSG = re.compile(r"(ENSCAFG\d+):")
+_RE_ENST = re.compile(r"(ENSCAFT\d+):")
+_RE_PROT = re.compile(r"p.([A-Z0-9a-z_.*-]*),")
+_RE_FS = re.compile(r"([A-Za-z])(\d+)([A-Za-z]*)(fs)")
+_RE_SNV = re.compile(r"([A-Za-z])(\d+)([A-Z])")
+
+
+## the gatk info looks like 0/1:36,7:43:99:..., the second field is the AD (ref,alt reads)
+## records without the AD field (ex: ./.) get NA for both reads
 def extractVAF(gatk_info):
-    if len(gatk_info.split(":")) > 1:
-        vaf_info = gatk_info.split(":")[1].split(",")
-        ref = int(vaf_info[0])
-        alt = int(vaf_info[1])
-        # vaf_value = float(alt/(ref+alt))
-    else:
-        ref = "No info provided"
-        alt = "No info provided"
+    ad_info = gatk_info.astype(str).str.split(":").str[1].str.split(",")
+    read_counts = pd.DataFrame(
+        {
+            "Ref_reads": pd.to_numeric(ad_info.str[0], errors="coerce"),
+            "Alt_reads": pd.to_numeric(ad_info.str[1], errors="coerce"),
+        },
+        index=gatk_info.index,
+    ).astype("Int32")
 
-    return pd.Series([ref, alt])
+    return read_counts
 
 
 ## the function is same as df.explode but in case pandas version < 1.3
@@ -47,47 +70,70 @@ def unnesting(df, explode):
 ## the function that use to extract the ensembl gene and ensembl transcripts given the annovar annotated results
 ## ex: 'ENSCAFG00000023363:ENSCAFT00000000040:exon7:c.762dupA:p.G255fs,' and it will return ENSCAFG0000023363, ENSCAFT0000000040, G255fs
 ## even we have multiple annotation, it will join them together with ','
-def extractAnnovarMutProtein(mut_info):
-    try:
-        Ensembl_gene = re.findall(r"(ENSCAFG)(\d+):", mut_info)
-        Ensembl_trans = re.findall(r"(ENSCAFT)(\d+):", mut_info)
-
-        ## the overall regex for annovar
-        total_protein_mut = re.findall(r"p.([A-Z0-9a-z_.*-]*),", mut_info)
-        total_ensembl_gene = ["".join(i) for i in Ensembl_gene]
-        Total_protein_change = ["".join(i) for i in total_protein_mut]
-        total_trans = ["".join(i) for i in Ensembl_trans]
-        diff = abs(len(Total_protein_change) != len(total_trans))
-        # in case that the annovar ensemble transcripts and the protein changes are not the same length, I add "No_Info_Provided" until they are the same
-        while diff != 0:
-            if len(Total_protein_change) > len(total_trans):
-                total_trans += ["No_Info_Provided"]
-                total_ensembl_gene += ["No_Info_Provided"]
-            elif len(Total_protein_change) < len(total_trans):
-                Total_protein_change += ["No_Info_Provided"]
-
-            diff = abs(len(Total_protein_change) != len(total_trans))
-
-        # combine into a big string
-        Total_ensembl_gene = ",".join(total_ensembl_gene)
-        Total_protein_change = ",".join(Total_protein_change)
-        total_trans = ",".join(total_trans)
-
-        final_return = pd.Series(
-            [Total_ensembl_gene, total_trans, Total_protein_change]
+## it works on the whole Annovar_info column and returns the Ensembl_gene, Ensembl_transcripts and Total_protein_change with the same "No_Info_Provided" padding
+def extractAnnovarMutProteins(annovar_info):
+    annovar_info = annovar_info.fillna("").astype(str)
+    total_ensembl_gene = annovar_info.str.findall(_RE_ENSG)
+    total_trans = annovar_info.str.findall(_RE_ENST)
+    Total_protein_change = annovar_info.str.findall(_RE_PROT)
+
+    # in case that the annovar ensemble transcripts and the protein changes are not the same length, I add "No_Info_Provided" until they are the same
+    protein_len = Total_protein_change.str.len()
+    trans_len = total_trans.str.len()
+    trans_padding = (protein_len - trans_len).clip(lower=0)
+    protein_padding = (trans_len - protein_len).clip(lower=0)
+
+    def join_with_padding(mut_info_list, padding):
+        joined_info = mut_info_list.str.join(",")
+        padding_info = (
+            pd.Series("No_Info_Provided,", index=mut_info_list.index)
+            .str.repeat(padding)
+            .str[:-1]
+        )
+        separator = np.where((mut_info_list.str.len() > 0) & (padding > 0), ",", "")
+        return joined_info + separator + padding_info
+
+    annovar_mut_protein = pd.DataFrame(
+        {
+            "Ensembl_gene": join_with_padding(total_ensembl_gene, trans_padding),
+            "Ensembl_transcripts": join_with_padding(total_trans, trans_padding),
+            "Total_protein_change": join_with_padding(
+                Total_protein_change, protein_padding
+            ),
+        },
+        index=annovar_info.index,
+    )
+
+    return annovar_mut_protein
+
+
+## only read the gatk columns we use: chrom, ref, alt, gatk info and sample name
+def read_gatk_output(gatk_vcf, gatk_columns=(0, 3, 4, 9, 10)):
+    gatk_columns = list(gatk_columns)
+    if CSV_ENGINE == "pyarrow":
+        gatk_table = pyarrow.csv.read_csv(
+            gatk_vcf,
+            read_options=pyarrow.csv.ReadOptions(autogenerate_column_names=True),
+            parse_options=pyarrow.csv.ParseOptions(delimiter="\t"),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=["f" + str(column) for column in gatk_columns]
+            ),
         )
+        gatk_data = gatk_table.to_pandas()
+        gatk_data.columns = gatk_columns
+    else:
+        gatk_data = pd.read_csv(gatk_vcf, sep="\t", header=None, usecols=gatk_columns)
 
-        return final_return
-    except:
-        print("There is an error in sample " + sample_name)
+    return gatk_data
 
 
 def process_gatk_output(gatk_vcf):
-    gatk_data = pd.read_csv(gatk_vcf, sep="\t", header=None)
-    gatk_data.loc[:, "Line"] = ["line" + str(i + 1) for i in range(0, len(gatk_data))]
-    gatk_data.loc[:, ["Ref_reads", "Alt_reads"]] = (
-        gatk_data[9].astype(str).apply(extractVAF).to_numpy()
-    )
+    gatk_data = read_gatk_output(gatk_vcf)
+    ## Line is the record number (annovar line1 is the first gatk record), keep it as int
+    gatk_data["Line"] = np.arange(1, len(gatk_data) + 1, dtype=np.int32)
+    gatk_data[["Ref_reads", "Alt_reads"]] = extractVAF(gatk_data[9])
+    ## remove records without VAF info here, so they don't go into the merge with annovar
+    gatk_data = gatk_data.dropna(subset=["Ref_reads", "Alt_reads"])
 
     target_gatk = gatk_data.loc[:, [0, 3, 4, 9, 10, "Ref_reads", "Alt_reads", "Line"]]
     target_gatk.columns = [
@@ -111,7 +157,11 @@ def process_gatk_output(gatk_vcf):
 ## Line','Consequence','Gene_name','Chrom','Start','End','Ref','Alt','Sample_name','Ensembl_gene','Ensembl_transcripts','Total_protein_change'
 ## the reason I keep line is for future used for VAF calculation
 def processAnnovar(annovar_gene_file, retro_gene_file, sample_name):
-    retro_gene_list = pd.read_csv(retro_gene_file, header=None)[0].tolist()
+    retro_gene_list = [
+        retro_gene
+        for retro_gene in Path(retro_gene_file).read_text().splitlines()
+        if retro_gene
+    ]
     annovar_gene_data = pd.read_csv(annovar_gene_file, sep="\t", header=None)
     # Define column names for Annovar gene data
     annovar_output_col = [
@@ -132,11 +182,15 @@ def processAnnovar(annovar_gene_file, retro_gene_file, sample_name):
         "Sample_name",
     ]
     annovar_gene_data.columns = annovar_output_col
-    annovar_gene_data.loc[
-        :, ["Ensembl_gene", "Ensembl_transcripts", "Total_protein_change"]
-    ] = (annovar_gene_data["Annovar_info"].apply(extractAnnovarMutProtein).to_numpy())
+    ## annovar writes line1, line2..., keep only the number so it can merge with the gatk records
+    annovar_gene_data["Line"] = pd.to_numeric(
+        annovar_gene_data["Line"].astype(str).str.replace("line", "", regex=False)
+    ).astype(np.int32)
+    annovar_gene_data[
+        ["Ensembl_gene", "Ensembl_transcripts", "Total_protein_change"]
+    ] = extractAnnovarMutProteins(annovar_gene_data["Annovar_info"])
     ## in case the Ensembl_transcripts and Total_protein_change are not in the same length,
-    ## I add "No_Info_Provided" in the extractAnnovarMutProtein steps, so we need to exclude that information
+    ## I add "No_Info_Provided" in the extractAnnovarMutProteins steps, so we need to exclude that information
     annovar_gene_data = annovar_gene_data.loc[
         (annovar_gene_data["Ensembl_transcripts"] != "No_Info_Provided")
         & (annovar_gene_data["Total_protein_change"] != "No_Info_Provided")
@@ -185,18 +239,28 @@ def processAnnovar(annovar_gene_file, retro_gene_file, sample_name):
     target_annovar_info = target_annovar_info[
         ~target_annovar_info.Ensembl_gene.isin(retro_gene_list)
     ]
-    target_annovar_info.loc[:, "Gene_mut_info"] = (
-        target_annovar_info["Gene_name"]
+    target_annovar_info = target_annovar_info.assign(
+        Gene_mut_info=lambda annovar_df: annovar_df["Gene_name"]
         + "_"
-        + target_annovar_info["Total_protein_change"]
-    )
-    target_annovar_info.loc[:, "Transcript_mut_info"] = (
-        target_annovar_info["Ensembl_transcripts"]
+        + annovar_df["Total_protein_change"],
+        Transcript_mut_info=lambda annovar_df: annovar_df["Ensembl_transcripts"]
         + "_"
-        + target_annovar_info["Total_protein_change"]
+        + annovar_df["Total_protein_change"],
     )
     # Drop duplicate entries
     target_annovar_info = target_annovar_info.drop_duplicates()
+    ## these columns have few unique values compared to the number of records,
+    ## category saves memory and makes the merge and isin work on the integer codes
+    for category_column in [
+        "Chrom",
+        "Consequence",
+        "Gene_name",
+        "Ensembl_gene",
+        "Ensembl_transcripts",
+    ]:
+        target_annovar_info[category_column] = target_annovar_info[
+            category_column
+        ].astype("category")
     return target_annovar_info
 
 
@@ -211,38 +275,31 @@ def convertEmptyGene(GeneName):
     return GeneName
 
 
-def createDictforHumanDogSearch(clean_translate_table):
-    total_dict = {}
-    #### create human_dog translation dict for future search
-    human_dog_pos_dict = {}
-    dog_human_pos_dict = {}
-    human_aa_dict = {}
-    dog_aa_dict = {}
-
-    for entry in clean_translate_table:
-        gene = entry[1]
-        human_pos = entry[2]
-        dog_pos = entry[3]
-        human_aa = entry[4]
-        dog_aa = entry[5]
-
-        if gene not in human_dog_pos_dict:
-            human_dog_pos_dict[gene] = {}
-            dog_human_pos_dict[gene] = {}
-            human_aa_dict[gene] = {}
-            dog_aa_dict[gene] = {}
-
-        human_dog_pos_dict[gene][human_pos] = dog_pos
-        dog_human_pos_dict[gene][dog_pos] = human_pos
-        human_aa_dict[gene][human_pos] = human_aa
-        dog_aa_dict[gene][dog_pos] = dog_aa
-
-    total_dict["human_dog_pos_dict"] = human_dog_pos_dict
-    total_dict["dog_human_pos_dict"] = dog_human_pos_dict
-    total_dict["human_aa_dict"] = human_aa_dict
-    total_dict["dog_aa_dict"] = dog_aa_dict
+## human_dog translation tables for future search, kept as two flat tables,
+## one indexed by (gene, human pos) and one by (gene, dog pos), so the translation can be done with merge
+## the last record wins if the same position is listed twice
+def createLookupforHumanDogSearch(clean_translate_table):
+    total_lookup = {}
+    translate_lookup = clean_translate_table.iloc[:, :5].copy()
+    translate_lookup.columns = ["Gene", "HumanPos", "DogPos", "HumanAA", "DogAA"]
+    for pos_column in ["HumanPos", "DogPos"]:
+        translate_lookup[pos_column] = pd.to_numeric(
+            translate_lookup[pos_column], errors="coerce"
+        ).astype("Int64")
+    translate_lookup = translate_lookup.dropna(subset=["HumanPos", "DogPos"])
+
+    total_lookup["human_pos_lookup"] = (
+        translate_lookup.drop_duplicates(subset=["Gene", "HumanPos"], keep="last")
+        .set_index(["Gene", "HumanPos"])
+        .loc[:, ["DogPos", "HumanAA"]]
+    )
+    total_lookup["dog_pos_lookup"] = (
+        translate_lookup.drop_duplicates(subset=["Gene", "DogPos"], keep="last")
+        .set_index(["Gene", "DogPos"])
+        .loc[:, ["HumanPos", "DogAA"]]
+    )
 
-    return total_dict
+    return total_lookup
 
 
 common_amino_acid_value = collections.OrderedDict(
@@ -276,163 +333,335 @@ common_amino_acid_value = collections.OrderedDict(
 
 ## current function only care about SNV and fs, and these two is the only we can do the dog_human comparison
 ## the consequence results (fs,snv) are derived from annovar annotation results, other annotation might not work
-def identify_species_counterparts(
-    gene_mut_info,
-    human_dog_pos_dict,
-    dog_human_pos_dict,
-    human_aa_dict,
-    dog_aa_dict,
+## it splits Gene_mut_info once and extracts wt, pos, mut for fs and SNV (stop_gain) mutations
+## (delines can't process because we don't know the downstream)
+## Situation is "fs" or "SNV" for the rows we can translate, otherwise it keeps the reason why we can't
+def parse_gene_mut_info(gene_mut_info):
+    gene_mut_split = gene_mut_info.str.split("_")
+    mut_info = gene_mut_split.str[1].fillna("")
+
+    fs_info = mut_info.str.extract(_RE_FS)
+    SNV_info = mut_info.str.extract(_RE_SNV)
+    has_fs = mut_info.str.contains("fs", regex=False)
+    is_fs = has_fs & fs_info[0].notna()
+    is_SNV = ~has_fs & SNV_info[0].notna()
+
+    situation = np.select(
+        [is_fs, has_fs, is_SNV],
+        ["fs", "No Counterparts", "SNV"],
+        default="Not SNV or FS",
+    )
+    parsed_mut_info = pd.DataFrame(
+        {
+            "Gene": gene_mut_split.str[0],
+            "WT": fs_info[0].where(is_fs, SNV_info[0]),
+            "Pos": pd.to_numeric(fs_info[1].where(is_fs, SNV_info[1])).astype("Int64"),
+            "Mut": SNV_info[2].where(is_SNV, ""),
+            "Situation": situation,
+        },
+        index=gene_mut_info.index,
+    )
+
+    return parsed_mut_info
+
+
+## translate each row of parse_gene_mut_info output to the other species counterparts (ex: TP53_R175H),
+## or keep the reason why we can't translate it
+def translate_species_counterparts(
+    parsed_mut_info,
+    human_pos_lookup,
+    dog_pos_lookup,
     translate_to,
 ):
-    gene_name = gene_mut_info.split("_")[0]
-    mut_info = gene_mut_info.split("_")[1]
-    ## if we want to translate to dog, then we need to use human_dog_pos_dict and vise versa
+    ## if we want to translate to dog, then we need to search human pos and vise versa
     if translate_to.upper() == "DOG":
-        ref_dict, alt_dict = human_dog_pos_dict, dog_human_pos_dict
-        other_species_aa_dict = dog_aa_dict
+        ref_lookup, other_species_lookup = human_pos_lookup, dog_pos_lookup
+        other_pos_column, other_aa_column = "DogPos", "DogAA"
     else:
-        ref_dict, alt_dict = dog_human_pos_dict, human_dog_pos_dict
-        other_species_aa_dict = human_aa_dict
-
-    pos = 0
-    other_counterparts = " "
-
-    ## extract mutation data
-    ## consider three situation, SNV (stop_gain), fs, and other can't process (delines can't process because we don't know the downstream)
-
-    if "fs" in mut_info:
-        if re.search(r"([A-Za-z])(\d+)([A-Za-z]*)(fs)", mut_info):
-            fs_info = re.search(r"([A-Za-z])(\d+)([A-Za-z]*)(fs)", mut_info)
-            wt = fs_info.group(1)
-            pos = int(fs_info.group(2))
-            mut = ""
-            # final_mut_info = wt+loc+fs
-            situation = "fs"
-        else:
-            other_counterparts = "No Counterparts"
-
-    ## SNV or stop gain
-    elif re.search(r"([A-Za-z])(\d+)([A-Z])", mut_info):
-        SNV_info = re.search(r"([A-Za-z])(\d+)([A-Z])", mut_info)
-        wt = SNV_info.group(1)
-        pos = int(SNV_info.group(2))
-        mut = SNV_info.group(3)
-
-        situation = "SNV"
-    else:  ## if not SNV or fs types, just directly skip it (include delines)
-        other_counterparts = "Not SNV or FS"
-
-    if other_counterparts == " ":
-        if gene_name in alt_dict.keys():
-            ## if snv or fs
-            if (
-                (wt.upper() in common_amino_acid_value.keys())
-                and (mut.upper() in common_amino_acid_value.keys())
-            ) or ((wt.upper() in common_amino_acid_value.keys()) and mut == ""):
-                if pos in ref_dict[gene_name].keys():
-                    other_species_pos = ref_dict[gene_name][pos]
-
-                    if other_species_pos in other_species_aa_dict[gene_name]:
-                        other_species_wt = other_species_aa_dict[gene_name][
-                            other_species_pos
-                        ]
-                        given_species_mut = mut
-                        ## if mutation is synonymous SNV, then just replace the location and use counterparts WT for both aa
-                        if wt == mut:
-                            other_counterparts = (
-                                gene_name
-                                + "_"
-                                + other_species_wt
-                                + str(other_species_pos)
-                                + other_species_wt
-                            )
-
-                        elif given_species_mut == other_species_wt:
-                            other_counterparts = "No mutation"
-                        else:
-                            if situation == "SNV":
-                                ## if the mutation is synonymous SNV
-
-                                other_counterparts = (
-                                    gene_name
-                                    + "_"
-                                    + other_species_wt
-                                    + str(other_species_pos)
-                                    + given_species_mut
-                                )
-                            elif situation == "fs":
-                                other_counterparts = (
-                                    gene_name
-                                    + "_"
-                                    + other_species_wt
-                                    + str(other_species_pos)
-                                    + "fs"
-                                )
-
-                    else:
-                        other_counterparts = "Another species doesnt have the pos"
-                        #'Another species doesnt have the pos'
-                else:
-                    other_counterparts = "Current pos cannot align to another species"
-                    #'Current pos cannot align to another species'
-            else:
-                other_counterparts = "Not common amino acids"
-        else:
-            other_counterparts = "Another species doesn't have the gene name"
-            #'Another species has no '+gene_name+' in the databases'
-
-    return other_counterparts
+        ref_lookup, other_species_lookup = dog_pos_lookup, human_pos_lookup
+        other_pos_column, other_aa_column = "HumanPos", "HumanAA"
 
+    counterparts = pd.Series(
+        parsed_mut_info["Situation"].to_numpy(dtype=object),
+        index=parsed_mut_info.index,
+    )
+    parsed = parsed_mut_info.loc[parsed_mut_info["Situation"].isin(["fs", "SNV"])]
+    if parsed.empty:
+        return counterparts
+
+    gene_name = parsed["Gene"]
+    wt = parsed["WT"]
+    mut = parsed["Mut"]
+    is_SNV = parsed["Situation"] == "SNV"
+    ## (gene, pos) -> other species pos, then (gene, other species pos) -> other species aa
+    translate_info = parsed.loc[:, ["Gene", "Pos"]].merge(
+        ref_lookup.loc[:, [other_pos_column]],
+        left_on=["Gene", "Pos"],
+        right_index=True,
+        how="left",
+        validate="m:1",
+    )
+    translate_info = translate_info.merge(
+        other_species_lookup.loc[:, [other_aa_column]],
+        left_on=["Gene", other_pos_column],
+        right_index=True,
+        how="left",
+        validate="m:1",
+    )
+    other_species_pos = pd.Series(
+        translate_info[other_pos_column].array, index=parsed.index
+    )
+    other_species_wt = pd.Series(
+        translate_info[other_aa_column].array, index=parsed.index
+    )
 
-## this function will select the mutations that can be found in human somatic db from (C-bio, or cosmeic) after human-dog position translation
-def extract_human_somatic(
-    mutation_file,
-    human_dog_alginemt_file,
-    human_dog_transcript,
-    target_merge_gatk_annovar,
-    translate_to,
+    has_gene = gene_name.isin(ref_lookup.index.levels[0])
+    common_aa = wt.str.upper().isin(common_amino_acid_value.keys()) & (
+        ~is_SNV | mut.str.upper().isin(common_amino_acid_value.keys())
+    )
+    has_pos = other_species_pos.notna()
+    has_other_aa = other_species_wt.notna()
+
+    other_species_wt = other_species_wt.fillna("").astype(str)
+    ## keep the pos as integer, a float pos gives TP53_R175.0H and it never matches the mutation set
+    counterparts_prefix = (
+        gene_name
+        + "_"
+        + other_species_wt
+        + other_species_pos.astype("Int64").astype(str)
+    )
+    ## synonymous SNV use counterparts WT for both aa, and fs keep the fs
+    counterparts_suffix = np.select(
+        [wt == mut, is_SNV], [other_species_wt, mut], default="fs"
+    )
+    counterparts.loc[parsed.index] = np.select(
+        [
+            ~has_gene,
+            ~common_aa,
+            ~has_pos,
+            ~has_other_aa,
+            (wt != mut) & (mut == other_species_wt),
+        ],
+        [
+            "Another species doesn't have the gene name",
+            "Not common amino acids",
+            "Current pos cannot align to another species",
+            "Another species doesnt have the pos",
+            "No mutation",
+        ],
+        default=counterparts_prefix + counterparts_suffix,
+    )
+
+    return counterparts
+
+
+## genomic mutation key chrom_pos_ref_alt (ex: chr11_2053289_T_C), it is built in one pass over the arrays
+## instead of adding the columns together, which creates a temporary Series for every "+"
+def build_chrom_mut_info(chrom, pos, ref, alt):
+    chrom_mut_info = pd.array(
+        [
+            f"{each_chrom}_{each_pos}_{each_ref}_{each_alt}"
+            for each_chrom, each_pos, each_ref, each_alt in zip(
+                chrom.to_numpy(dtype=object),
+                pos.to_numpy(),
+                ref.to_numpy(dtype=object),
+                alt.to_numpy(dtype=object),
+            )
+        ],
+        dtype="string",
+    )
+
+    return chrom_mut_info
+
+
+## read the tab separated reference tables in data_source
+def read_reference_table(reference_file, **kwargs):
+    return pd.read_csv(reference_file, sep="\t", engine=CSV_ENGINE, **kwargs)
+
+
+## this function will read the human somatic db (C-bio, or cosmic) with its human-dog alignment and transcript files
+## and return everything extract_human_somatic needs, so it can be cached and shared between samples
+def load_human_somatic_reference(
+    mutation_file, human_dog_alginemt_file, human_dog_transcript
 ):
-    copy_target_merge_gatk_annovar = target_merge_gatk_annovar.copy()
-    mutation_data = pd.read_csv(mutation_file, sep="\t")
-    all_mutation_list = ",".join(mutation_data["Mut_type"]).split(",")
+    human_somatic_reference = {}
+    mutation_data = read_reference_table(
+        mutation_file, usecols=["Mut_type"], dtype={"Mut_type": "string"}
+    )
+    ## stream the comma separated mutations into a set instead of joining them into one huge string first
+    human_somatic_reference["all_mutation_set"] = frozenset(
+        chain.from_iterable(
+            mut_type.split(",") for mut_type in mutation_data["Mut_type"].dropna()
+        )
+    )
 
-    translate_allign_table = pd.read_csv(human_dog_alginemt_file, sep="\t")
+    translate_allign_table = read_reference_table(
+        human_dog_alginemt_file, dtype={"QueryIdx": "string", "QueryAA": "string"}
+    )
     translate_allign_table.loc[
         translate_allign_table["QueryAA"] == "-", "QueryIdx"
     ] = "-"
     clean_translate_table = translate_allign_table[
         translate_allign_table["QueryIdx"] != "-"
     ]
+    human_somatic_reference.update(createLookupforHumanDogSearch(clean_translate_table))
 
-    total_summary_dict = createDictforHumanDogSearch(clean_translate_table.to_records())
-
-    copy_target_merge_gatk_annovar[
-        "Human_counterpart"
-    ] = copy_target_merge_gatk_annovar["Gene_mut_info"].apply(
-        identify_species_counterparts,
-        human_dog_pos_dict=total_summary_dict["human_dog_pos_dict"],
-        dog_human_pos_dict=total_summary_dict["dog_human_pos_dict"],
-        human_aa_dict=total_summary_dict["human_aa_dict"],
-        dog_aa_dict=total_summary_dict["dog_aa_dict"],
-        translate_to=translate_to,
-    )
-
-    human_dog_transcript_info = pd.read_csv(
+    human_dog_transcript_info = read_reference_table(
         human_dog_transcript,
-        sep="\t",
         header=None,
         names=["Gene_name", "Human_transcripts", "Dog_transcripts"],
+        dtype="string",
+    )
+    ## keep the dog transcripts as an Index, so isin doesn't need to rebuild it from a Series every time
+    human_somatic_reference["dog_transcripts"] = pd.Index(
+        human_dog_transcript_info["Dog_transcripts"].dropna().unique()
+    )
+
+    return human_somatic_reference
+
+
+## the genomic mutations (chrom+pos+ref+alt) identified in canine pan-cancer, indexed by Chrom_mut_info for the merge
+def load_pan_cancer_reference(pan_cancer_annovar_file):
+    pan_cancer_data = read_reference_table(
+        pan_cancer_annovar_file,
+        usecols=["Chrom", "Pos", "Ref", "Alt"],
+        dtype={"Chrom": "string", "Pos": "int64", "Ref": "string", "Alt": "string"},
+    )
+    pan_cancer_data["Chrom_mut_info"] = build_chrom_mut_info(
+        pan_cancer_data["Chrom"],
+        pan_cancer_data["Pos"],
+        pan_cancer_data["Ref"],
+        pan_cancer_data["Alt"],
+    )
+    pan_cancer_keys = (
+        pan_cancer_data[["Chrom_mut_info"]]
+        .drop_duplicates()
+        .set_index("Chrom_mut_info")
+    )
+
+    return pan_cancer_keys
+
+
+## change it when the structure returned by the reference loaders changes, so the old cache is not used
+REFERENCE_CACHE_VERSION = 6
+
+
+## the reference files never change between samples, so the loader output is pickled in cache_folder
+## the cache file name comes from the loader, the path, size and modified time of each reference file,
+## if any reference file is updated, a new cache file will be created
+def load_cached_reference(loader, reference_files, cache_folder):
+    reference_signature = [loader.__name__, REFERENCE_CACHE_VERSION]
+    for reference_file in reference_files:
+        file_stat = os.stat(reference_file)
+        reference_signature.append(
+            (str(reference_file), file_stat.st_mtime_ns, file_stat.st_size)
+        )
+    cache_key = hashlib.md5(repr(reference_signature).encode()).hexdigest()
+    cache_file = Path(cache_folder) / (loader.__name__ + "_" + cache_key + ".pkl")
+
+    if cache_file.exists():
+        try:
+            with open(cache_file, "rb") as cache_handle:
+                return pickle.load(cache_handle)
+        ## a cache written by another pandas/pyarrow install may not load here, just rebuild it
+        except Exception:
+            pass
+
+    reference = loader(*reference_files)
+    ## write to a temporary file first, other samples running at the same time won't read a partial cache
+    ## if the package location is read-only, we just skip the cache
+    try:
+        Path(cache_folder).mkdir(parents=True, exist_ok=True)
+        tmp_cache_file = cache_file.with_suffix(".pkl." + str(os.getpid()))
+        with open(tmp_cache_file, "wb") as cache_handle:
+            pickle.dump(reference, cache_handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_cache_file, cache_file)
+    except OSError:
+        pass
+
+    return reference
+
+
+## build (or load from the cache) all of the reference tables in package_location/data_source
+@functools.lru_cache(maxsize=None)
+def build_reference_indices(package_location):
+    package_location = Path(package_location)
+    data_source = package_location / "data_source"
+    cache_folder = package_location / "cache"
+
+    pan_cancer_annovar_file = (
+        data_source
+        / "Ge2_Pass_QC_Pan_Cancer_Final_Mutect_annovar_include_syn_mutation_summary.txt"
+    )
+    c_bioportal_file = data_source / "all_studies_c-bio_portal_somatic_mutation.txt"
+    cosmic_file = data_source / "GRCh37_V95_Cosmic_somatic_mutation.txt"
+    c_bio_translate_file = (
+        data_source / "c-bio_Human_GR37_103_canine_3.199_sequenceAlignment.txt"
+    )
+    cosmic_translate_file = (
+        data_source / "COSMIC_V95_Human_GR37_93_canine_3.199_sequenceAlignment.txt"
+    )
+    c_biohuman_dog_transcript = (
+        data_source / "c_bioportal_Human_GR37_103_dog_transcript_3.199.txt"
+    )
+    cosm_human_dog_transcript = (
+        data_source / "COSMIC_Human_GR37_V95_93_dog_transcript_3.199.txt"
+    )
+
+    reference_indices = {}
+    reference_indices["pan_cancer"] = load_cached_reference(
+        load_pan_cancer_reference, [pan_cancer_annovar_file], cache_folder
+    )
+    reference_indices["c_bio"] = load_cached_reference(
+        load_human_somatic_reference,
+        [c_bioportal_file, c_bio_translate_file, c_biohuman_dog_transcript],
+        cache_folder,
     )
+    reference_indices["cosmic"] = load_cached_reference(
+        load_human_somatic_reference,
+        [cosmic_file, cosmic_translate_file, cosm_human_dog_transcript],
+        cache_folder,
+    )
+
+    return reference_indices
 
-    transcript_match_target_annovar = copy_target_merge_gatk_annovar.loc[
-        copy_target_merge_gatk_annovar["Ensembl_transcripts"].isin(
-            human_dog_transcript_info["Dog_transcripts"]
+
+## this function will select the mutations that can be found in human somatic db from (C-bio, or cosmeic) after human-dog position translation
+def extract_human_somatic(
+    human_somatic_reference,
+    target_merge_gatk_annovar,
+    translate_to,
+    parsed_mut_info=None,
+):
+    ## parsed_mut_info is parse_gene_mut_info of Gene_mut_info, pass it in to share the parsing between C-bio and cosmic
+    if parsed_mut_info is None:
+        parsed_mut_info = parse_gene_mut_info(
+            target_merge_gatk_annovar["Gene_mut_info"]
         )
-    ]
 
+    dog_transcripts = human_somatic_reference["dog_transcripts"]
+    annovar_transcripts = target_merge_gatk_annovar["Ensembl_transcripts"]
+    ## if the transcripts are category, only the categories need to be compared with the db
+    if isinstance(annovar_transcripts.dtype, pd.CategoricalDtype):
+        dog_transcripts = annovar_transcripts.cat.categories.intersection(
+            dog_transcripts
+        )
+    transcript_match = annovar_transcripts.isin(dog_transcripts).to_numpy()
+    transcript_match_target_annovar = target_merge_gatk_annovar.loc[transcript_match]
+
+    ## only the records with the transcripts in the db need to be translated
+    human_counterpart = translate_species_counterparts(
+        parsed_mut_info.loc[transcript_match],
+        human_pos_lookup=human_somatic_reference["human_pos_lookup"],
+        dog_pos_lookup=human_somatic_reference["dog_pos_lookup"],
+        translate_to=translate_to,
+    )
+
+    ## the db has millions of mutations, so check each counterpart against the prebuilt set,
+    ## isin would rebuild a hash table from the whole db every call
+    all_mutation_set = human_somatic_reference["all_mutation_set"]
     pass_data = transcript_match_target_annovar.loc[
-        transcript_match_target_annovar["Human_counterpart"].isin(all_mutation_list)
+        [counterpart in all_mutation_set for counterpart in human_counterpart]
     ]
-    pass_data = pass_data.drop(columns="Human_counterpart")
 
     return pass_data